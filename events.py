@@ -3,18 +3,27 @@ Events Module
 Fetches and parses iCal data for specific event types.
 """
 
+import asyncio
+import functools
 import os
-import json
+import re
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
 from datetime import datetime, date, timedelta
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional
 import aiohttp
-from icalendar import Calendar
+from icalendar import Event as VEvent
+from storage import JSONDecodeError, load_json, load_jsonl, save_json, save_jsonl
 
 # Use data folder for persistence (mounted as Docker volume)
 DATA_DIR = Path(__file__).parent / "data"
 DATA_DIR.mkdir(exist_ok=True)
-EVENTS_FILE = DATA_DIR / "events.json"
+# One event per line (JSON Lines)
+EVENTS_FILE = DATA_DIR / "events.jsonl"
+# ETag/Last-Modified of the feed the cached events came from
+EVENTS_META_FILE = DATA_DIR / "events_meta.json"
 
 # Event types and their keywords case-insensitive
 EVENT_TYPES = {
@@ -24,6 +33,11 @@ EVENT_TYPES = {
     "extended_homeroom": "extended homeroom",
 }
 
+# (keyword, event type) pairs, frozen once for matching event names
+_EVENT_TYPE_ITEMS: tuple[tuple[str, str], ...] = tuple(
+    (keyword.lower(), event_type) for event_type, keyword in EVENT_TYPES.items()
+)
+
 # Display names
 EVENT_TYPE_DISPLAY = {
     "dress_day": "Dress Day",
@@ -44,6 +58,24 @@ EVENT_TYPE_EMOJI = {
 PING_EVENT_TYPES = {"dress_day", "late_start", "extended_homeroom"}
 
 
+@dataclass(slots=True)
+class Event:
+    """A calendar event of one of the tracked types."""
+    event_type: str
+    date: str  # ISO format (YYYY-MM-DD)
+    event_title: str
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Event":
+        """Create an event from its cached dict form (extra keys are ignored)."""
+        return cls(data["event_type"], data["date"], data["event_title"])
+
+    def to_dict(self) -> dict:
+        """Get the dict form of the event for caching."""
+        return {"event_type": self.event_type, "date": self.date, "event_title": self.event_title}
+
+
+@functools.lru_cache(maxsize=512)
 def format_date(date_str: str) -> str:
     """Format a date string (YYYY-MM-DD) to a friendly format like 'Monday, December 1st'."""
     d = date.fromisoformat(date_str)
@@ -59,39 +91,186 @@ def format_date(date_str: str) -> str:
     return d.strftime(f"%A, %B {day}{suffix}")
 
 
+# Escaped characters in iCal TEXT values
+TEXT_ESCAPE_PATTERN = re.compile(r"\\([\\,;nN])")
+
+
+def _unescape_text(value: str) -> str:
+    """Unescape an iCal TEXT value."""
+    return TEXT_ESCAPE_PATTERN.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def _scan_vevent(lines: list[bytes]) -> Optional[tuple[str, Optional[date]]]:
+    """
+    Quickly pull the summary and start date out of a VEVENT's raw lines.
+    Returns None if the event uses something this doesn't handle (so icalendar should parse it).
+    """
+    # Unfold continuation lines (they start with a space or tab)
+    unfolded: list[bytes] = []
+    for line in lines:
+        line = line.rstrip(b"\r\n")
+        if line[:1] in (b" ", b"\t") and unfolded:
+            unfolded[-1] += line[1:]
+        else:
+            unfolded.append(line)
+
+    summary = ""
+    dtstart = None
+    depth = 0
+    for line in unfolded:
+        name, sep, value = line.partition(b":")
+        if not sep:
+            continue
+        name = name.upper()
+        if name == b"BEGIN":
+            depth += 1
+        elif name == b"END":
+            depth -= 1
+        elif depth == 1:
+            # Skip properties of nested components like VALARM
+            prop, _, params = name.partition(b";")
+            if prop not in (b"SUMMARY", b"DTSTART"):
+                continue
+            if b'"' in params:
+                # Quoted parameters can contain ':', so the split above may be wrong
+                return None
+            if prop == b"SUMMARY":
+                try:
+                    summary = _unescape_text(value.decode("utf-8"))
+                except UnicodeDecodeError:
+                    # Not UTF-8, icalendar copes with other encodings
+                    return None
+            else:
+                dtstart = value
+
+    if dtstart is None:
+        return summary, None
+
+    # DATE and DATE-TIME values both start with YYYYMMDD
+    # (taken as written, like icalendar's .date() on a datetime)
+    if len(dtstart) < 8 or not dtstart[:8].isdigit():
+        return None
+    try:
+        return summary, date(int(dtstart[:4]), int(dtstart[4:6]), int(dtstart[6:8]))
+    except ValueError:
+        return None
+
+
+def _read_vevent(lines: list[bytes]) -> tuple[str, Optional[date]]:
+    """Get the summary and start date of a VEVENT using icalendar."""
+    component = VEvent.from_ical(b"".join(lines))
+    summary = str(component.get("summary", ""))
+    dtstart = component.get("dtstart")
+    if not dtstart:
+        return summary, None
+    event_date = dtstart.dt
+    # Handle both date and datetime objects
+    if isinstance(event_date, datetime):
+        event_date = event_date.date()
+    return summary, event_date
+
+
 class CalendarEvents:
     def __init__(self):
-        self.events: list[dict] = []
+        self.events: list[Event] = []
+        # Per type events (sorted by date) and a parallel, compact array of their date ordinals
+        self._by_type: dict[str, list[Event]] = {}
+        self._type_ords: dict[str, array] = {}
+        # Events keyed by their ISO date
+        self._by_date: dict[str, list[Event]] = {}
+        # HTTP session reused across fetches (created on first use)
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Feed URL and cache validators used for conditional requests
+        self._feed_meta: dict = {}
         self._load_from_file()
 
     def _load_from_file(self) -> None:
-        """Load events from JSON file if it exists."""
+        """Load events from JSON Lines file if it exists."""
         if EVENTS_FILE.exists():
             try:
-                with open(EVENTS_FILE, "r") as f:
-                    self.events = json.load(f)
+                self.events = [Event.from_dict(row) for row in load_jsonl(EVENTS_FILE)]
                 print(f"Loaded {len(self.events)} events from cache.")
-            except (json.JSONDecodeError, IOError) as e:
+            except (JSONDecodeError, KeyError, IOError) as e:
                 print(f"Error loading events file: {e}")
                 self.events = []
+        if EVENTS_META_FILE.exists():
+            try:
+                self._feed_meta = load_json(EVENTS_META_FILE)
+            except (JSONDecodeError, IOError) as e:
+                print(f"Error loading events meta file: {e}")
+                self._feed_meta = {}
+        self._build_index()
+
+    def _build_index(self) -> None:
+        """Bucket the (date sorted) events by type and by date for quick lookups."""
+        self._by_type = {t: [] for t in EVENT_TYPES}
+        self._type_ords = {t: array("l") for t in EVENT_TYPES}
+        self._by_date = {}
+        for e in self.events:
+            self._by_type.setdefault(e.event_type, []).append(e)
+            self._type_ords.setdefault(e.event_type, array("l")).append(date.fromisoformat(e.date).toordinal())
+            self._by_date.setdefault(e.date, []).append(e)
 
     def _save_to_file(self) -> None:
-        """Save events to JSON file."""
+        """Save events to JSON Lines file."""
         try:
-            with open(EVENTS_FILE, "w") as f:
-                json.dump(self.events, f, indent=2)
-            print(f"Saved {len(self.events)} events to cache.")
+            if save_jsonl(EVENTS_FILE, [e.to_dict() for e in self.events]):
+                print(f"Saved {len(self.events)} events to cache.")
+            # Only after the events are saved, so the validators never describe newer events than the cache
+            save_json(EVENTS_META_FILE, self._feed_meta)
         except IOError as e:
             print(f"Error saving events file: {e}")
 
     def _get_event_type(self, event_name: str) -> Optional[str]:
         """Check if event name matches any keyword and return the event type."""
         event_name_lower = event_name.lower()
-        for event_type, keyword in EVENT_TYPES.items():
+        for keyword, event_type in _EVENT_TYPE_ITEMS:
             if keyword in event_name_lower:
                 return event_type
         return None
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Get the shared HTTP session, creating it if needed."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        return self._session
+
+    async def close(self) -> None:
+        """Close the shared HTTP session."""
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def _iter_vevents(self, response: aiohttp.ClientResponse) -> AsyncIterator[list[bytes]]:
+        """Read the response line by line and yield the lines of each VEVENT as it's completed."""
+        lines: list[bytes] = []
+        in_event = False
+        async for line in response.content:
+            tag = line.strip().upper()
+            if tag == b"BEGIN:VEVENT":
+                in_event = True
+                lines = []
+            if in_event:
+                lines.append(line)
+                if tag == b"END:VEVENT":
+                    in_event = False
+                    yield lines
+                    # Let the event loop run (keeps the Discord heartbeat going)
+                    await asyncio.sleep(0)
+
+    def _parse_vevent(self, lines: list[bytes]) -> Optional[Event]:
+        """Turn a VEVENT into an Event, or None if it's not a tracked event type."""
+        fields = _scan_vevent(lines)
+        if fields is None:
+            # Something the quick scanner doesn't handle, let icalendar deal with it
+            fields = _read_vevent(lines)
+        event_name, event_date = fields
+
+        event_type = self._get_event_type(event_name)
+        if not event_type or not event_date:
+            return None
+
+        return Event(event_type, event_date.isoformat(), event_name)
+
     async def fetch_and_parse(self, ical_url: Optional[str] = None) -> int:
         """
         Fetch iCal data from URL and parse for matching events.
@@ -107,49 +286,47 @@ class CalendarEvents:
             print("Error: No iCal URL provided. Use /set-calendar-url to set one.")
             return 0
 
+        # Only ask for changes if the cached events came from this same URL
+        headers = {}
+        if self.events and self._feed_meta.get("url") == url:
+            if self._feed_meta.get("etag"):
+                headers["If-None-Match"] = self._feed_meta["etag"]
+            if self._feed_meta.get("last_modified"):
+                headers["If-Modified-Since"] = self._feed_meta["last_modified"]
+
+        # Parse events as they stream in rather than loading the whole file at once
+        events = []
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        print(f"Error fetching calendar: HTTP {response.status}")
-                        return 0
-                    ical_data = await response.text()
-        except aiohttp.ClientError as e:
+            async with self._get_session().get(url, headers=headers) as response:
+                if response.status == 304:
+                    print(f"Calendar unchanged, keeping {len(self.events)} cached events.")
+                    return len(self.events)
+                if response.status != 200:
+                    print(f"Error fetching calendar: HTTP {response.status}")
+                    return 0
+                feed_meta = {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+                async for lines in self._iter_vevents(response):
+                    event = self._parse_vevent(lines)
+                    if event:
+                        events.append(event)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             print(f"Error fetching calendar: {e}")
             return 0
-
-        # Parse the iCal data
-        try:
-            cal = Calendar.from_ical(ical_data)
         except Exception as e:
             print(f"Error parsing iCal data: {e}")
             return 0
 
-        # Clear existing events + parse new ones
-        self.events = []
-
-        for component in cal.walk():
-            if component.name == "VEVENT":
-                event_name = str(component.get("summary", ""))
-                event_type = self._get_event_type(event_name)
-
-                if event_type:
-                    # Get the event date
-                    dtstart = component.get("dtstart")
-                    if dtstart:
-                        event_date = dtstart.dt
-                        # Handle both date and datetime objects
-                        if isinstance(event_date, datetime):
-                            event_date = event_date.date()
-                        
-                        self.events.append({
-                            "event_type": event_type,
-                            "date": event_date.isoformat(),
-                            "event_title": event_name,
-                        })
+        # Replace existing events with the new ones
+        self.events = events
+        self._feed_meta = feed_meta
 
         # Sort by date
-        self.events.sort(key=lambda x: x["date"])
+        self.events.sort(key=lambda x: x.date)
+        self._build_index()
         
         # Save to file
         self._save_to_file()
@@ -157,26 +334,21 @@ class CalendarEvents:
         print(f"Found {len(self.events)} matching events.")
         return len(self.events)
 
-    def get_upcoming_by_type(self, event_type: str, limit: int = 5) -> list[dict]:
+    def get_upcoming_by_type(self, event_type: str, limit: int = 5) -> list[Event]:
         """Get upcoming events of a specific type (from today onwards)."""
-        today = date.today()
-        upcoming = [
-            e for e in self.events
-            if e["event_type"] == event_type and date.fromisoformat(e["date"]) >= today
-        ]
-        return upcoming[:limit]
-
-    def get_events_for_date(self, target_date: date) -> list[dict]:
+        start = bisect_left(self._type_ords.get(event_type, []), date.today().toordinal())
+        return self._by_type.get(event_type, [])[start:start + limit]
+
+    def get_events_for_date(self, target_date: date) -> list[Event]:
         """Get all events for a specific date."""
-        date_str = target_date.isoformat()
-        return [e for e in self.events if e["date"] == date_str]
+        return self._by_date.get(target_date.isoformat(), [])
 
-    def get_tomorrow_events(self) -> list[dict]:
+    def get_tomorrow_events(self) -> list[Event]:
         """Get all events for tomorrow (used for 5pm notifications)."""
         tomorrow = date.today() + timedelta(days=1)
         return self.get_events_for_date(tomorrow)
 
-    def get_all_events(self) -> list[dict]:
+    def get_all_events(self) -> list[Event]:
         """Get all stored events."""
         return self.events
 
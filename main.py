@@ -1,11 +1,14 @@
 import os
+import hashlib
 import discord
+from time import time as now_timestamp
 from datetime import time, datetime
 from discord.ext import commands, tasks
 from discord import app_commands
 from dotenv import load_dotenv
-from events import calendar, EVENT_TYPE_DISPLAY, EVENT_TYPE_EMOJI, PING_EVENT_TYPES, format_date
+from events import calendar, Event, EVENT_TYPES, EVENT_TYPE_DISPLAY, EVENT_TYPE_EMOJI, PING_EVENT_TYPES, format_date
 from settings import settings
+from storage import dumps
 
 # Load environment variables
 load_dotenv()
@@ -15,12 +18,21 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+
+class FoxBot(commands.Bot):
+    async def close(self):
+        # Write pending settings and clean up the calendar's HTTP session before shutting down
+        settings.flush()
+        await calendar.close()
+        await super().close()
+
+
+bot = FoxBot(command_prefix='!', intents=intents)
 
 
 #------------ Helper Functions---------
 
-def format_events_embed(events: list[dict], title: str, emoji: str, color: discord.Color) -> discord.Embed:
+def format_events_embed(events: list[Event], title: str, emoji: str, color: discord.Color) -> discord.Embed:
     """Format a list of events into a Discord embed."""
     embed = discord.Embed(title=f"{emoji} {title}", color=color)
     
@@ -28,10 +40,10 @@ def format_events_embed(events: list[dict], title: str, emoji: str, color: disco
         embed.description = "No upcoming events found."
     else:
         for event in events:
-            formatted_date = format_date(event["date"])
+            formatted_date = format_date(event.date)
             embed.add_field(
                 name=formatted_date,
-                value=event["event_title"],
+                value=event.event_title,
                 inline=False
             )
     
@@ -43,11 +55,27 @@ def get_event_color(event_type: str) -> discord.Color:
     return discord.Color.red()
 
 
+def get_command_tree_hash() -> str:
+    """Hash the slash command definitions, to tell if they changed since the last sync."""
+    command_data = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    return hashlib.sha256(dumps(command_data)).hexdigest()
+
+
 # ------------ scheduled stuff------
 
+# Discord's limit on embeds in a single message
+MAX_EMBEDS_PER_MESSAGE = 10
+
+# (emoji, display name, color) for each event type, built once for the notification loop
+_NOTIF_META = {
+    event_type: (EVENT_TYPE_EMOJI.get(event_type, "📌"), EVENT_TYPE_DISPLAY.get(event_type, event_type), get_event_color(event_type))
+    for event_type in EVENT_TYPES
+}
+
+
 @tasks.loop(time=time(hour=17, minute=0))  # 5:00 PM daily
 async def daily_notification():
-    """Send individual notifications at 5pm for tomorrow's events."""
+    """Send notifications at 5pm for tomorrow's events."""
     channel_id = settings.notification_channel_id
     if not channel_id:
         print("Notification channel not set, skipping daily notification.")
@@ -59,27 +87,33 @@ async def daily_notification():
         return
     
     tomorrow_events = calendar.get_tomorrow_events()
+    ping_everyone = settings.ping_everyone
     
-    # Send message for each event
+    # Build an embed for each event
+    embeds: list[tuple[discord.Embed, bool]] = []
     for event in tomorrow_events:
-        event_type = event["event_type"]
-        emoji = EVENT_TYPE_EMOJI.get(event_type, "📌")
-        display_name = EVENT_TYPE_DISPLAY.get(event_type, event_type)
-        color = get_event_color(event_type)
+        event_type = event.event_type
+        emoji, display_name, color = _NOTIF_META.get(event_type) or ("📌", event_type, get_event_color(event_type))
         
         embed = discord.Embed(
             title=f"{emoji} {display_name} Tomorrow!",
-            description=event["event_title"],
+            description=event.event_title,
             color=color
         )
-        embed.add_field(name="Date", value=format_date(event["date"]), inline=False)
-        
-        should_ping = settings.ping_everyone and event_type in PING_EVENT_TYPES
+        embed.add_field(name="Date", value=format_date(event.date), inline=False)
         
-        if should_ping:
-            await channel.send(content="@everyone", embed=embed)
-        else:
-            await channel.send(embed=embed)
+        should_ping = ping_everyone and event_type in PING_EVENT_TYPES
+        embeds.append((embed, should_ping))
+    
+    # Send them together in as few messages as possible
+    for i in range(0, len(embeds), MAX_EMBEDS_PER_MESSAGE):
+        chunk = embeds[i:i + MAX_EMBEDS_PER_MESSAGE]
+        any_ping = any(should_ping for _, should_ping in chunk)
+        await channel.send(
+            content="@everyone" if any_ping else None,
+            embeds=[embed for embed, _ in chunk],
+            allowed_mentions=discord.AllowedMentions(everyone=any_ping)
+        )
 
 
 @tasks.loop(hours=24)
@@ -104,9 +138,14 @@ async def on_ready():
     if not daily_calendar_sync.is_running():
         daily_calendar_sync.start()
     
-    # Sync slash commands with Discord
-    await bot.tree.sync()
-    print('Slash commands synced!')
+    # Sync slash commands with Discord, only if they changed (syncing is heavily rate limited)
+    tree_hash = get_command_tree_hash()
+    if settings.command_tree_hash == tree_hash:
+        print('Slash commands unchanged, skipping sync.')
+    else:
+        await bot.tree.sync()
+        settings.command_tree_hash = tree_hash
+        print('Slash commands synced!')
 
 
 # ---- Commands ------
@@ -123,17 +162,22 @@ MIDYEARS_DATE = datetime(2025, 12, 15, 8, 30)
 WINTER_BREAK_DATE = datetime(2025, 12, 18, 14, 0)
 END_OF_SCHOOL_DATE = datetime(2026, 5, 29, 11, 0)
 
+# as local timestamps, so countdowns don't need to build datetimes
+MIDYEARS_TS = MIDYEARS_DATE.timestamp()
+WINTER_BREAK_TS = WINTER_BREAK_DATE.timestamp()
+END_OF_SCHOOL_TS = END_OF_SCHOOL_DATE.timestamp()
+
 
-def format_countdown(target: datetime) -> str:
-    """Format the time remaining until a target date."""
-    now = datetime.now()
+def format_countdown(target_ts: float) -> str:
+    """Format the time remaining until a target timestamp."""
+    now = now_timestamp()
     
-    if now >= target:
+    if now >= target_ts:
         return "already happened! 🎉"
     
-    delta = target - now
-    days = delta.days
-    hours, remainder = divmod(delta.seconds, 3600)
+    total = int(target_ts - now)
+    days, remainder = divmod(total, 86400)
+    hours, remainder = divmod(remainder, 3600)
     minutes = remainder // 60
     
     if days > 0:
@@ -146,7 +190,7 @@ def format_countdown(target: datetime) -> str:
 
 @bot.tree.command(name="days-until-midyears", description="Countdown to midyear exams")
 async def days_until_midyears(interaction: discord.Interaction):
-    countdown = format_countdown(MIDYEARS_DATE)
+    countdown = format_countdown(MIDYEARS_TS)
     embed = discord.Embed(
         title="📚 Midyears Countdown",
         description=f"Time until midyears:\n{countdown}",
@@ -158,7 +202,7 @@ async def days_until_midyears(interaction: discord.Interaction):
 
 @bot.tree.command(name="days-until-winter-break", description="Countdown to winter break")
 async def days_until_winter_break(interaction: discord.Interaction):
-    countdown = format_countdown(WINTER_BREAK_DATE)
+    countdown = format_countdown(WINTER_BREAK_TS)
     embed = discord.Embed(
         title="❄️ Winter Break Countdown",
         description=f"Time until winter break:\n{countdown}",
@@ -170,7 +214,7 @@ async def days_until_winter_break(interaction: discord.Interaction):
 
 @bot.tree.command(name="days-until-end-of-school", description="Countdown to end of school")
 async def days_until_end_of_school(interaction: discord.Interaction):
-    countdown = format_countdown(END_OF_SCHOOL_DATE)
+    countdown = format_countdown(END_OF_SCHOOL_TS)
     embed = discord.Embed(
         title="🎓 End of School Countdown",
         description=f"Time until end of school:\n{countdown}",
@@ -324,5 +368,12 @@ async def toggle_ping_everyone(interaction: discord.Interaction):
         )
 
 
+# Use uvloop's faster event loop when it's available
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 bot.run(TOKEN)
 
@@ -3,59 +3,87 @@ Settings Module
 Manages bot configuration stored in a JSON file.
 """
 
-import json
+import asyncio
 from pathlib import Path
 from typing import Any, Optional
+from storage import JSONDecodeError, load_json, save_json
 
 # Use data folder for persistence (mounted as Docker volume)
 DATA_DIR = Path(__file__).parent / "data"
 DATA_DIR.mkdir(exist_ok=True)
 SETTINGS_FILE = DATA_DIR / "settings.json"
 
+# Seconds to wait before writing changes, so several updates become one write
+SAVE_DELAY = 1.0
+
 # Default settings
 DEFAULT_SETTINGS = {
     "notification_channel_id": None,
     "ical_url": None,
     "ping_everyone": True,  # Ping @everyone for important events
+    "command_tree_hash": None,  # Hash of the slash commands last synced with Discord
 }
 
 
 class Settings:
     def __init__(self):
         self._settings: dict = {}
+        # Set when there are changes that haven't been written yet
+        self._dirty = False
+        self._save_handle: Optional[asyncio.TimerHandle] = None
         self._load()
 
     def _load(self) -> None:
         """Load settings from JSON file."""
         if SETTINGS_FILE.exists():
             try:
-                with open(SETTINGS_FILE, "r") as f:
-                    self._settings = json.load(f)
+                self._settings = load_json(SETTINGS_FILE)
                 print(f"Loaded settings from {SETTINGS_FILE}")
-            except (json.JSONDecodeError, IOError) as e:
+            except (JSONDecodeError, IOError) as e:
                 print(f"Error loading settings: {e}")
                 self._settings = DEFAULT_SETTINGS.copy()
         else:
             self._settings = DEFAULT_SETTINGS.copy()
-            self._save()
+            self._save_now()
 
-    def _save(self) -> None:
+    def _save_now(self) -> None:
         """Save settings to JSON file."""
+        self._dirty = False
+        if self._save_handle:
+            self._save_handle.cancel()
+            self._save_handle = None
         try:
-            with open(SETTINGS_FILE, "w") as f:
-                json.dump(self._settings, f, indent=2)
-            print(f"Saved settings to {SETTINGS_FILE}")
+            if save_json(SETTINGS_FILE, self._settings):
+                print(f"Saved settings to {SETTINGS_FILE}")
         except IOError as e:
             print(f"Error saving settings: {e}")
 
+    def _schedule_save(self) -> None:
+        """Save settings shortly, batching up any other changes made before then."""
+        self._dirty = True
+        if self._save_handle:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not running in the event loop, nothing to batch with
+            self._save_now()
+            return
+        self._save_handle = loop.call_later(SAVE_DELAY, self._save_now)
+
+    def flush(self) -> None:
+        """Write any pending changes right away (used on shutdown)."""
+        if self._dirty:
+            self._save_now()
+
     def get(self, key: str, default: Any = None) -> Any:
         """Get a setting value."""
         return self._settings.get(key, default)
 
     def set(self, key: str, value: Any) -> None:
-        """Set a setting value and save."""
+        """Set a setting value and schedule a save."""
         self._settings[key] = value
-        self._save()
+        self._schedule_save()
 
     @property
     def notification_channel_id(self) -> Optional[int]:
@@ -88,6 +116,16 @@ class Settings:
         """Set whether to ping @everyone for important events."""
         self.set("ping_everyone", value)
 
+    @property
+    def command_tree_hash(self) -> Optional[str]:
+        """Get the hash of the last synced slash commands."""
+        return self._settings.get("command_tree_hash")
+
+    @command_tree_hash.setter
+    def command_tree_hash(self, value: str) -> None:
+        """Set the hash of the last synced slash commands."""
+        self.set("command_tree_hash", value)
+
 
 # Global instance
 settings = Settings()
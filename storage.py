@@ -0,0 +1,77 @@
+"""
+Storage Module
+JSON (and JSON Lines) helpers shared by the events and settings caches.
+"""
+
+import os
+from pathlib import Path
+from typing import Any
+
+# orjson is a lot faster than the stdlib json module, but fall back if it's missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import json
+
+# Errors raised for malformed JSON (orjson's error subclasses the stdlib one)
+JSONDecodeError = orjson.JSONDecodeError if orjson else json.JSONDecodeError
+
+
+def dumps(data: Any) -> bytes:
+    """Serialize data to indented UTF-8 JSON bytes."""
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2).encode()
+
+
+def dumps_line(data: Any) -> bytes:
+    """Serialize data to a single line of compact UTF-8 JSON bytes."""
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def loads(raw: bytes) -> Any:
+    """Deserialize JSON bytes."""
+    if orjson:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def load_json(path: Path) -> Any:
+    """Read and parse a JSON file."""
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def load_jsonl(path: Path) -> list:
+    """Read and parse a JSON Lines file, one value per line."""
+    with open(path, "rb") as f:
+        return [loads(line) for line in f if line.strip()]
+
+
+def _write_atomic(path: Path, raw: bytes) -> bool:
+    """
+    Write bytes to a file, replacing it atomically and leaving it alone if the content hasn't changed.
+    Returns whether the file was written.
+    """
+    if path.exists() and path.read_bytes() == raw:
+        return False
+
+    # Write to a temp file first so a crash can't leave a half written file
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(raw)
+    os.replace(tmp_path, path)
+    return True
+
+
+def save_json(path: Path, data: Any) -> bool:
+    """Serialize data and write it to a JSON file. Returns whether the file was written."""
+    return _write_atomic(path, dumps(data))
+
+
+def save_jsonl(path: Path, rows: list) -> bool:
+    """Write rows to a JSON Lines file, one per line. Returns whether the file was written."""
+    return _write_atomic(path, b"".join(dumps_line(row) + b"\n" for row in rows))